@@ -1,17 +1,21 @@
 from .elasticsearch import (
     check_elasticsearch,
     document_exists,
+    documents_exist,
     index_to_elasticsearch,
     get_response_value,
     fields_in_hits,
+    fields_in_index,
 )
 
 from .asyncelasticsearch import (
     async_check_elasticsearch,
     async_document_exists,
+    async_documents_exist,
     async_index_to_elasticsearch,
     async_get_response_value,
     async_fields_in_hits,
+    async_fields_in_index,
 )
 
 from .client import get_elasticsearch_client, get_async_elasticsearch_client
@@ -1,9 +1,34 @@
 from __future__ import annotations
 
+import hashlib
 import os
+import threading
+from collections import OrderedDict
 
 import elasticsearch
 
+from .serializer import get_serializer
+
+# clients are reused per connection config so their connection pools stay warm,
+# the least recently used client is dropped once more than this many configs are in use
+MAX_CACHED_CLIENTS = 8
+_ELASTICSEARCH_CLIENTS: OrderedDict[Tuple[Any, ...], elasticsearch.Elasticsearch] = (
+    OrderedDict()
+)
+# the factory can be called from parallel_bulk worker threads
+_ELASTICSEARCH_CLIENTS_LOCK = threading.Lock()
+
+
+def _client_is_closed(elasticsearch_client: elasticsearch.Elasticsearch) -> bool:
+    """
+    Whether close() was called on a client, which leaves its urllib3 pools unusable
+    """
+
+    return any(
+        connection.pool.pool is None
+        for connection in elasticsearch_client.transport.connection_pool.connections
+    )
+
 
 def get_elasticsearch_client(
     elasticsearch_client_fqdn: Optional[str] = os.getenv("ELASTICBUD_CLIENT_FQDN"),
@@ -13,6 +38,7 @@ def get_elasticsearch_client(
     elasticsearch_username: Optional[str] = os.getenv("ELASTICBUD_USERNAME"),
     elasticsearch_password: Optional[str] = os.getenv("ELASTICBUD_PASSWORD"),
     elasticsearch_timeout: int = os.getenv("ELASTICBUD_TIMEOUT", 300),
+    elasticsearch_maxsize: int = 25,
 ) -> elasticsearch.Elasticsearch:
 
     for i, arg in enumerate(
@@ -25,18 +51,43 @@ def get_elasticsearch_client(
     ):
         assert arg is not None, f"set {i}: {arg}"
 
-    elasticsearch_client = elasticsearch.Elasticsearch(
-        hosts=[
-            {
-                "host": elasticsearch_client_fqdn,
-                "port": elasticsearch_client_port,
-            }
-        ],
-        timeout=300,
-        http_auth=(elasticsearch_username, elasticsearch_password),
-        use_ssl=True,
-        verify_certs=True,
+    client_key = (
+        elasticsearch_client_fqdn,
+        str(elasticsearch_client_port),
+        elasticsearch_username,
+        hashlib.sha256(elasticsearch_password.encode()).hexdigest(),
+        elasticsearch_timeout,
+        elasticsearch_maxsize,
     )
+    with _ELASTICSEARCH_CLIENTS_LOCK:
+        cached_client = _ELASTICSEARCH_CLIENTS.get(client_key)
+        if cached_client is not None and not _client_is_closed(cached_client):
+            _ELASTICSEARCH_CLIENTS.move_to_end(client_key)
+            return cached_client
+
+        elasticsearch_client = elasticsearch.Elasticsearch(
+            hosts=[
+                {
+                    "host": elasticsearch_client_fqdn,
+                    "port": elasticsearch_client_port,
+                }
+            ],
+            timeout=elasticsearch_timeout,
+            maxsize=elasticsearch_maxsize,
+            http_auth=(elasticsearch_username, elasticsearch_password),
+            use_ssl=True,
+            verify_certs=True,
+            http_compress=True,
+            serializer=get_serializer(),
+            max_retries=5,
+            retry_on_timeout=True,
+            retry_on_status=(429, 502, 503, 504),
+        )
+        _ELASTICSEARCH_CLIENTS[client_key] = elasticsearch_client
+        _ELASTICSEARCH_CLIENTS.move_to_end(client_key)
+        if len(_ELASTICSEARCH_CLIENTS) > MAX_CACHED_CLIENTS:
+            # callers may still hold the evicted client, so it is dropped rather than closed
+            _ELASTICSEARCH_CLIENTS.popitem(last=False)
 
     return elasticsearch_client
 
@@ -49,6 +100,7 @@ def get_async_elasticsearch_client(
     elasticsearch_username: Optional[str] = os.getenv("ELASTICBUD_USERNAME"),
     elasticsearch_password: Optional[str] = os.getenv("ELASTICBUD_PASSWORD"),
     elasticsearch_timeout: int = os.getenv("ELASTICBUD_TIMEOUT", 300),
+    elasticsearch_maxsize: int = 25,
 ) -> elasticsearch.AsyncElasticsearch:
 
     for i, arg in enumerate(
@@ -69,9 +121,15 @@ def get_async_elasticsearch_client(
             }
         ],
         timeout=elasticsearch_timeout,
+        maxsize=elasticsearch_maxsize,
         http_auth=(elasticsearch_username, elasticsearch_password),
         use_ssl=True,
         verify_certs=True,
+        http_compress=True,
+        serializer=get_serializer(),
+        max_retries=5,
+        retry_on_timeout=True,
+        retry_on_status=(429, 502, 503, 504),
     )
 
     return elasticsearch_client
@@ -1,19 +1,33 @@
 from __future__ import annotations
-import copy
 import json
 from pathlib import Path
 
 import elasticsearch
 from elasticsearch import Elasticsearch, AsyncElasticsearch
-from elasticsearch.helpers import bulk
-from tenacity import retry, stop_after_attempt, wait_fixed
+from elasticsearch.helpers import BulkIndexError, bulk, parallel_bulk
 
 from .errors import (
     ElasticsearchUnreachableError,
     ElasticsearchNotReadyError,
 )
 from .logger import get_logger
-from .utils import batch, recurse_splat_key
+from .utils import (
+    APPLIED_TEMPLATES,
+    INDEX_FIELDS,
+    batch,
+    identity_filters,
+    identity_key,
+    identity_preference,
+    index_fields_from_mapping,
+    load_template_file,
+    recurse_splat_key,
+)
+
+DEFAULT_BATCH_SIZE = 500
+MAX_CHUNK_BYTES = 10 * 1024 * 1024
+COMPOSITE_PAGE_SIZE = 1000
+# default index.max_result_window, the most hits a single search can return
+MAX_RESULT_WINDOW = 10000
 
 
 def check_elasticsearch(
@@ -39,7 +53,6 @@ def check_elasticsearch(
         ) from e
 
 
-@retry(stop=stop_after_attempt(5), wait=wait_fixed(0.5))
 def document_exists(
     elasticsearch_client: Elasticsearch,
     doc: Dict[str, Any],
@@ -50,38 +63,54 @@ def document_exists(
 
     log = get_logger("elasticbud.document_exists")
 
-    query_filters = list()
-    for field in identity_fields:
-        try:
-            query_filters.append(
-                {"terms": {field: doc[field]}}
-                if isinstance(doc[field], list)
-                else {"term": {field: doc[field]}}
-            )
-        except KeyError:
-            # if the doc is missing an identity field, we will index the new document
-            return False
+    query_filters = identity_filters(doc, identity_fields)
+    if query_filters is None:
+        # if the doc is missing an identity field, we will index the new document
+        return False
 
     body = {"query": {"bool": {"filter": query_filters}}}
 
+    if delete_if_exists:
+        # without an explicit size only the first 10 matches would be deleted
+        search_params = dict(
+            size=MAX_RESULT_WINDOW, _source=False, filter_path=["hits.hits._id"]
+        )
+    else:
+        # a single hit on any shard is enough to know the document exists
+        search_params = dict(
+            size=1,
+            _source=False,
+            terminate_after=1,
+            track_total_hits=False,
+            request_cache=True,
+            filter_path=["hits.hits._id"],
+        )
+    # route identical identity queries to the same shard copies so their cached results are reused
+    search_params.update(
+        preference=identity_preference(identity_key(doc, identity_fields))
+    )
+
     try:
-        resp = elasticsearch_client.search(index=index, body=body)
+        resp = elasticsearch_client.search(index=index, body=body, **search_params)
     except elasticsearch.exceptions.NotFoundError:
         return False
 
-    hits = resp["hits"]["hits"]
+    # filter_path drops the hits entirely when nothing matched
+    hits = resp.get("hits", {}).get("hits", [])
     if len(hits) > 0:
         if delete_if_exists:
             if len(hits) > 1:
                 log.warning(f"{len(hits)} {index} documents matched the query: {body}")
-            for hit in hits:
-                log.info(
-                    f"deleting existing {index} document matching query (id: {hit['_id']})"
-                )
-                try:
-                    elasticsearch_client.delete(index=index, id=hit["_id"])
-                except elasticsearch.exceptions.NotFoundError:
-                    continue
+            log.info(f"deleting {len(hits)} existing {index} documents matching query")
+            # documents already deleted elsewhere are not an error here, anything else raises
+            bulk(
+                elasticsearch_client,
+                (
+                    {"_op_type": "delete", "_index": index, "_id": hit["_id"]}
+                    for hit in hits
+                ),
+                ignore_status=(404,),
+            )
             return False
         else:
             return True
@@ -89,6 +118,102 @@ def document_exists(
         return False
 
 
+def _existing_ids_for_batch(
+    elasticsearch_client: Elasticsearch,
+    index: str,
+    docs: List[Dict[str, Any]],
+    identity_fields: List[str],
+    delete_if_exists: bool = False,
+) -> Set[Tuple[Any, ...]]:
+    """
+    Check a whole batch of documents for existing matches in a single msearch request,
+    returning the identity keys that matched
+    """
+
+    log = get_logger("elasticbud._existing_ids_for_batch")
+
+    # everything but the identity filters is shared by every search in the batch
+    search_params = {"_source": False}
+    if delete_if_exists:
+        # without an explicit size only the first 10 matches would be deleted
+        search_params.update(size=MAX_RESULT_WINDOW)
+    else:
+        search_params.update(size=1, terminate_after=1, track_total_hits=False)
+
+    keys = dict()
+    body = list()
+    for doc in docs:
+        key = identity_key(doc, identity_fields)
+        if key is None or key in keys:
+            # if the doc is missing an identity field, we will index the new document
+            continue
+        query_filters = identity_filters(doc, identity_fields)
+        keys[key] = doc
+        header = {
+            "request_cache": not delete_if_exists,
+            "preference": identity_preference(key),
+        }
+        body.extend(
+            [header, {**search_params, "query": {"bool": {"filter": query_filters}}}]
+        )
+
+    if len(keys) == 0:
+        return set()
+
+    try:
+        resp = elasticsearch_client.msearch(index=index, body=body)
+    except elasticsearch.exceptions.NotFoundError:
+        return set()
+
+    existing = set()
+    delete_ids = list()
+    for key, response in zip(keys, resp["responses"]):
+        if "error" in response:
+            error = response["error"]
+            if error.get("type") == "index_not_found_exception":
+                continue
+            # msearch answers 200 even when a search was rejected, so nothing was retried
+            status = response.get("status", "N/A")
+            raise elasticsearch.exceptions.HTTP_EXCEPTIONS.get(
+                status, elasticsearch.exceptions.TransportError
+            )(status, error.get("type"), response)
+        hits = response["hits"]["hits"]
+        if len(hits) > 0:
+            existing.add(key)
+            if delete_if_exists:
+                if len(hits) > 1:
+                    log.warning(f"{len(hits)} {index} documents matched identity {key}")
+                delete_ids.extend(hit["_id"] for hit in hits)
+
+    if len(delete_ids) > 0:
+        log.info(f"deleting {len(delete_ids)} existing {index} documents")
+        bulk(
+            elasticsearch_client,
+            ({"_op_type": "delete", "_index": index, "_id": _id} for _id in delete_ids),
+            # documents already deleted elsewhere are not an error here, anything else raises
+            ignore_status=(404,),
+        )
+
+    return existing
+
+
+def documents_exist(
+    elasticsearch_client: Elasticsearch,
+    docs: List[Dict[str, Any]],
+    index: str,
+    identity_fields: List[str],
+) -> List[bool]:
+    """
+    Check whether each of a list of documents exists, in a single msearch request
+    """
+
+    existing = _existing_ids_for_batch(
+        elasticsearch_client, index, docs, identity_fields
+    )
+
+    return [identity_key(doc, identity_fields) in existing for doc in docs]
+
+
 def doc_gen(
     elasticsearch_client: Elasticsearch,
     docs: List[Dict[str, Any]],
@@ -96,32 +221,50 @@ def doc_gen(
     identity_fields: Optional[List[str]],
     overwrite: bool,
     quiet: bool = False,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    refresh_before_check: bool = False,
+    counts: Optional[Dict[str, int]] = None,
 ) -> Generator[Dict[str, Any], None, None]:
 
     log = get_logger("elasticbud.doc_gen")
 
-    if identity_fields is not None:
-        # must have manage permission on index to refresh, this is only necessary for idempotent indexing calls
-        elasticsearch_client.indices.refresh(index=index, ignore_unavailable=True)
-
     yielded = 0
     exists = 0
-    for doc in docs:
-        doc = dict(
-            doc
-        )  # convert Index classes to plain dictionaries for Elasticsearch API
-        if identity_fields is not None and document_exists(
-            elasticsearch_client,
-            doc,
-            index,
-            identity_fields,
-            delete_if_exists=overwrite,
-        ):
-            exists += 1
-            continue
-        doc.update(_index=index)
-        yield doc
-        yielded += 1
+    for docs_batch in batch(docs, n=batch_size):
+        # convert Index classes to plain dictionaries for Elasticsearch API, plain dicts are used as-is
+        docs_batch = [doc if type(doc) is dict else dict(doc) for doc in docs_batch]
+
+        existing = set()
+        if identity_fields is not None:
+            if refresh_before_check:
+                # must have manage permission on index to refresh, this makes recent writes visible to the check
+                elasticsearch_client.indices.refresh(
+                    index=index, ignore_unavailable=True
+                )
+            existing = _existing_ids_for_batch(
+                elasticsearch_client,
+                index,
+                docs_batch,
+                identity_fields,
+                delete_if_exists=overwrite,
+            )
+
+        for doc in docs_batch:
+            if (
+                identity_fields is not None
+                and not overwrite
+                and identity_key(doc, identity_fields) in existing
+            ):
+                exists += 1
+                continue
+            # the bulk helpers copy each document while lifting its metadata keys (_id, _routing, ...),
+            # the target index is passed to the bulk request instead of being merged into a copy here
+            yield doc
+            yielded += 1
+    if counts is not None:
+        # lets callers that split the input across several doc_gens report the totals
+        counts["yielded"] = counts.get("yielded", 0) + yielded
+        counts["exists"] = counts.get("exists", 0) + exists
     if not quiet:
         log.info(
             f"{yielded} documents yielded for indexing to {index}"
@@ -129,7 +272,6 @@ def doc_gen(
         )
 
 
-@retry(stop=stop_after_attempt(5), wait=wait_fixed(0.5))
 def index_to_elasticsearch(
     elasticsearch_client: Elasticsearch,
     index: str,
@@ -139,13 +281,17 @@ def index_to_elasticsearch(
     index_template: Optional[Union[str, Path, Dict[str, Any]]] = None,
     batch_size: Optional[int] = None,
     quiet: bool = False,
+    refresh_before_check: bool = False,
+    thread_count: int = 4,
+    queue_size: int = 4,
+    pause_refresh: bool = False,
 ) -> None:
 
     log = get_logger("elasticbud.index_to_elasticsearch")
 
     if index_template is not None:
         if isinstance(index_template, str) or isinstance(index_template, Path):
-            template_body = json.loads(Path(index_template).read_text())
+            template_body = load_template_file(index_template)
             template_source = f"JSON file {index_template}"
         elif isinstance(index_template, dict):
             template_body = index_template
@@ -155,34 +301,108 @@ def index_to_elasticsearch(
                 f"could not figure out how to treat passed index_template: {index_template}"
             )
 
-        elasticsearch_client.indices.put_template(name=index, body=template_body)
-        log.debug(f"applied index template named '{index}' from {template_source}")
+        host = elasticsearch_client.transport.hosts[0]["host"]
+        port = elasticsearch_client.transport.hosts[0]["port"]
+        template_key = (host, port, index)
+        serialized_template = json.dumps(template_body, sort_keys=True)
 
-    if batch_size is None:
-        bulk(
-            elasticsearch_client,
-            doc_gen(
-                elasticsearch_client, docs, index, identity_fields, overwrite, quiet
-            ),
-        )
-    else:
-        for docs_batch in batch(docs, n=batch_size):
-            bulk(
+        if APPLIED_TEMPLATES.get(template_key) == serialized_template:
+            log.debug(f"index template named '{index}' is already applied")
+        else:
+            elasticsearch_client.indices.put_template(name=index, body=template_body)
+            APPLIED_TEMPLATES[template_key] = serialized_template
+            log.debug(f"applied index template named '{index}' from {template_source}")
+
+    refresh_intervals = dict()
+    if pause_refresh:
+        # disable refresh while bulk indexing, restoring each index's previous interval afterwards,
+        # this needs manage permission on the index and is unsafe with concurrent writers to it
+        try:
+            settings = elasticsearch_client.indices.get_settings(
+                index=index, name="index.refresh_interval"
+            )
+            refresh_intervals = {
+                name: value["settings"].get("index", {}).get("refresh_interval")
+                for name, value in settings.items()
+            }
+            elasticsearch_client.indices.put_settings(
+                index=index, body={"index": {"refresh_interval": "-1"}}
+            )
+        except elasticsearch.exceptions.NotFoundError:
+            # the index will be created by the bulk request
+            pass
+
+    chunk_size = batch_size or DEFAULT_BATCH_SIZE
+    errors = list()
+    try:
+        if identity_fields is None:
+            # nothing to deduplicate, so chunks are sent concurrently,
+            # up to thread_count * queue_size chunks of batch_size documents are held in memory at once
+            for ok, info in parallel_bulk(
                 elasticsearch_client,
                 doc_gen(
                     elasticsearch_client,
-                    docs_batch,
+                    docs,
                     index,
                     identity_fields,
                     overwrite,
                     quiet,
+                    batch_size=chunk_size,
                 ),
+                thread_count=thread_count,
+                queue_size=queue_size,
+                chunk_size=chunk_size,
+                max_chunk_bytes=MAX_CHUNK_BYTES,
+                index=index,
+                raise_on_error=False,
+            ):
+                if not ok:
+                    errors.append(info)
+        else:
+            # each batch is sent before the next one is checked, so duplicates across batches
+            # are caught when refresh_before_check makes the previous batch visible
+            indexed = 0
+            counts = dict()
+            for docs_batch in batch(docs, n=chunk_size):
+                success, batch_errors = bulk(
+                    elasticsearch_client,
+                    doc_gen(
+                        elasticsearch_client,
+                        docs_batch,
+                        index,
+                        identity_fields,
+                        overwrite,
+                        quiet=True,
+                        batch_size=chunk_size,
+                        refresh_before_check=refresh_before_check,
+                        counts=counts,
+                    ),
+                    chunk_size=chunk_size,
+                    max_chunk_bytes=MAX_CHUNK_BYTES,
+                    index=index,
+                    raise_on_error=False,
+                )
+                indexed += success
+                errors.extend(batch_errors)
+            if not quiet:
+                exists = counts.get("exists", 0)
+                log.info(
+                    f"{indexed} documents indexed to {index}"
+                    + (f" ({exists} already existed)" if exists > 0 else "")
+                )
+    finally:
+        for name, refresh_interval in refresh_intervals.items():
+            elasticsearch_client.indices.put_settings(
+                index=name, body={"index": {"refresh_interval": refresh_interval}}
             )
+    if len(errors) > 0:
+        raise BulkIndexError(
+            f"{len(errors)} document(s) failed to index to {index}", errors
+        )
     if not quiet:
         log.debug("bulk indexing complete")
 
 
-@retry(stop=stop_after_attempt(5), wait=wait_fixed(0.5))
 def get_response_value(
     elasticsearch_client: Elasticsearch,
     index: str,
@@ -196,13 +416,43 @@ def get_response_value(
 
     log = get_logger("elasticbud.get_response_value")
 
-    query = copy.deepcopy(query)
+    search_params = dict(size=size)
+    if composite_aggregation_name is not None:
+        # pagination only mutates the composite source, so copy the path down to it
+        aggs = query["aggs"]
+        composite_aggregation = aggs[composite_aggregation_name]
+        composite = {**composite_aggregation["composite"]}
+        if "*" in value_keys and composite.get("size", 10) < COMPOSITE_PAGE_SIZE:
+            # page boundaries are invisible when yielding single buckets, so fetch fewer, larger pages
+            composite.update(size=COMPOSITE_PAGE_SIZE)
+        query = {
+            **query,
+            "aggs": {
+                **aggs,
+                composite_aggregation_name: {
+                    **composite_aggregation,
+                    "composite": composite,
+                },
+            },
+        }
+        # only the paginated values and the continuation key need to be returned
+        value_path = (
+            value_keys[: value_keys.index("*")] if "*" in value_keys else value_keys
+        )
+        search_params.update(
+            filter_path=[
+                ".".join(value_path),
+                f"aggregations.{composite_aggregation_name}.after_key",
+            ],
+            # keep every page on the same shard copies
+            preference="_local",
+        )
 
     if debug:
         log.info(f"retrieving value from query against {index} at {value_keys}")
         print(f"GET /{index}/_search?size={size}\n{json.dumps(query,indent=2)}")
 
-    resp = elasticsearch_client.search(index=index, body=query, size=size)
+    resp = elasticsearch_client.search(index=index, body=query, **search_params)
 
     if composite_aggregation_name is not None:
         try:
@@ -212,21 +462,21 @@ def get_response_value(
                 f"No composite aggregation continuation key found at '{composite_aggregation_name}'"
             ) from exc
         values = 0
-        while len(list(recurse_splat_key(resp, value_keys))) > 0:
-            if len(list(recurse_splat_key(resp, value_keys))) == 1 and list(
-                recurse_splat_key(resp, value_keys)
-            ) == [[]]:
+        while True:
+            page_values = list(recurse_splat_key(resp, value_keys))
+            if len(page_values) == 0:
+                break
+            if page_values == [[]]:
                 # special case if the composite aggregation is asking to return the buckets without a terminal wildcard
                 break
-            for value in recurse_splat_key(resp, value_keys):
-                yield value
-                values += 1
+            yield from page_values
+            values += len(page_values)
 
             after_key = resp["aggregations"][composite_aggregation_name]["after_key"]
             query["aggs"][composite_aggregation_name]["composite"].update(
                 after=after_key
             )
-            resp = elasticsearch_client.search(index=index, body=query, size=size)
+            resp = elasticsearch_client.search(index=index, body=query, **search_params)
         log.debug(f"composite aggregation yielded {values} values")
 
     else:
@@ -247,12 +497,25 @@ def get_response_value(
 
 def fields_in_hits(hits: Iterator[Dict[str, Any]]) -> List[str]:
     """
-    List all unique field names present in a set of hits
+    List all unique field names present in a set of hits,
+    prefer fields_in_index unless documents may be missing from the mapping
     """
 
-    fields = set()
-    for hit in hits:
-        for field in hit["_source"].keys():
-            fields.add(field)
+    return list(set().union(*(hit["_source"].keys() for hit in hits)))
+
+
+def fields_in_index(elasticsearch_client: Elasticsearch, index: str) -> List[str]:
+    """
+    List all top level field names in an index mapping, cached per cluster and index,
+    so fields added to the mapping later are not seen until the process restarts
+    """
+
+    host = elasticsearch_client.transport.hosts[0]["host"]
+    port = elasticsearch_client.transport.hosts[0]["port"]
+    cache_key = (host, port, index)
+    if cache_key not in INDEX_FIELDS:
+        mappings = elasticsearch_client.indices.get_mapping(index=index)
+        INDEX_FIELDS[cache_key] = index_fields_from_mapping(mappings)
 
-    return list(fields)
+    # callers get their own list, so the cached fields can't be modified through it
+    return list(INDEX_FIELDS[cache_key])
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import json
+
+from elasticsearch.exceptions import SerializationError
+from elasticsearch.serializer import JSONSerializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class OrjsonSerializer(JSONSerializer):
+    """
+    Elasticsearch client serializer backed by orjson
+    """
+
+    def loads(self, s: Union[str, bytes]) -> Any:
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError as e:
+            raise SerializationError(s, e)
+
+    def dumps(self, data: Any) -> str:
+        # don't serialize strings
+        if isinstance(data, str):
+            return data
+
+        try:
+            return orjson.dumps(
+                data, default=self.default, option=orjson.OPT_NON_STR_KEYS
+            ).decode()
+        except orjson.JSONEncodeError as e:
+            raise SerializationError(data, e)
+
+
+def get_serializer() -> JSONSerializer:
+    """
+    Fastest available serializer for Elasticsearch clients
+    """
+
+    return OrjsonSerializer() if orjson is not None else JSONSerializer()
+
+
+def loads(data: bytes) -> Any:
+    """
+    Parse JSON bytes with orjson when it is installed
+    """
+
+    return orjson.loads(data) if orjson is not None else json.loads(data)
@@ -1,16 +1,27 @@
 from __future__ import annotations
 
-from copy import copy
+import hashlib
+from itertools import islice
+from pathlib import Path
 
 from .errors import AsteriskNotAtListError, InvalidSplatError, RecursedToKeyError
+from .serializer import loads
+
+# parsed index template files, keyed by path and invalidated by modification time
+_TEMPLATE_CACHE: Dict[str, Tuple[float, Dict[str, Any]]] = dict()
+
+# serialized index template bodies already applied by this process, keyed by (host, port, name)
+APPLIED_TEMPLATES: Dict[Tuple[str, Any, str], str] = dict()
+
+# top level field names of index mappings looked up by this process, keyed by (host, port, index)
+INDEX_FIELDS: Dict[Tuple[str, Any, str], Tuple[str, ...]] = dict()
 
 
 def recurse_splat_key(
     data: Dict[str, Any], value_keys: List[str]
 ) -> Generator[Any, None, None]:
-    value_keys = copy(value_keys)
     """
-        recurse to key with splat syntax for specifying "each key in list of objects"
+    recurse to key with splat syntax for specifying "each key in list of objects"
     """
     # try:
     #    if value_keys[-1] == "*":
@@ -18,31 +29,116 @@ def recurse_splat_key(
     # except IndexError as e:
     #    raise IndexError(f"recursed to empty keys: {data}")
 
-    value_key = value_keys[0]
+    last = len(value_keys) - 1
+    stack = [(data, 0)]
+    while stack:
+        data, i = stack.pop()
+        value_key = value_keys[i]
 
-    if value_key == "*":
-        if not isinstance(data, list):
-            raise AsteriskNotAtListError(f"data is not a list, has keys {data.keys()}")
-        if len(value_keys) == 1:  # last element is *, return data here
-            yield from data
-        else:  # need to keep recursing beyond wildcard
-            for datum in data:
-                yield from recurse_splat_key(datum, value_keys[1:])
+        if value_key == "*":
+            if not isinstance(data, list):
+                raise AsteriskNotAtListError(
+                    f"data is not a list, has keys {data.keys()}"
+                )
+            if i == last:  # last element is *, return data here
+                yield from data
+            else:  # need to keep descending beyond wildcard, in list order
+                stack.extend((datum, i + 1) for datum in reversed(data))
 
-    else:
-        if value_key not in data:
-            raise RecursedToKeyError(f"{data} contains no key {value_key}")
+        else:
+            if value_key not in data:
+                raise RecursedToKeyError(f"{data} contains no key {value_key}")
 
-        data = data[value_key]
+            if i == last:
+                yield data[value_key]
+            else:
+                stack.append((data[value_key], i + 1))
 
-        value_keys.pop(0)
-        if len(value_keys) == 0:
-            yield data
-        else:
-            yield from recurse_splat_key(data, value_keys)
 
+def identity_key(
+    doc: Dict[str, Any], identity_fields: List[str]
+) -> Optional[Tuple[Any, ...]]:
+    """
+    Hashable tuple of a document's identity field values, None if any are missing
+    """
+
+    try:
+        return tuple(
+            tuple(doc[field]) if isinstance(doc[field], list) else doc[field]
+            for field in identity_fields
+        )
+    except KeyError:
+        return None
+
+
+def identity_preference(key: Tuple[Any, ...]) -> str:
+    """
+    Search preference string for an identity key, stable across processes unlike hash()
+    """
+
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+def identity_filters(
+    doc: Dict[str, Any], identity_fields: List[str]
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Term filters matching a document's identity field values, None if any are missing
+    """
+
+    try:
+        values = [doc[field] for field in identity_fields]
+    except KeyError:
+        return None
+
+    return [
+        {"terms" if isinstance(value, list) else "term": {field: value}}
+        for field, value in zip(identity_fields, values)
+    ]
+
+
+def batch(iterable: Iterable, n: int = 1) -> Generator[List, None, None]:
+    """
+    Lazily split any iterable into lists of at most n items
+    """
+
+    if n < 1:
+        # islice would yield nothing and the whole iterable would be silently dropped
+        raise ValueError(f"batch size must be at least 1, got {n}")
+
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, n))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def load_template_file(path: Union[str, Path]) -> Dict[str, Any]:
+    """
+    Parse an index template JSON file, reusing the last parse while the file is unchanged
+    """
+
+    path = Path(path)
+    mtime = path.stat().st_mtime
+    cached = _TEMPLATE_CACHE.get(str(path))
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, loads(path.read_bytes()))
+        _TEMPLATE_CACHE[str(path)] = cached
+
+    return cached[1]
+
+
+def index_fields_from_mapping(mappings: Dict[str, Any]) -> Tuple[str, ...]:
+    """
+    Top level field names across every index in a get_mapping response
+    """
 
-def batch(iterable: Iterable, n: int = 1) -> Generator[Iterable, None, None]:
-    l = len(iterable)
-    for ndx in range(0, l, n):
-        yield iterable[ndx : min(ndx + n, l)]
+    return tuple(
+        set().union(
+            *(
+                index_mapping["mappings"].get("properties", {}).keys()
+                for index_mapping in mappings.values()
+            )
+        )
+    )
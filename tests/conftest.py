@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from elasticbud import get_elasticsearch_client, index_to_elasticsearch
+from elasticbud.serializer import loads
+
+
+TEST_INDEX_NAME = "elasticbud-test-data"
+# read-only tests get their own index, so they never race the tests that delete and reindex TEST_INDEX_NAME
+READ_INDEX_NAME = f"{TEST_INDEX_NAME}-read"
+
+_HERE = Path(__file__).parent
+DATA_PATH = _HERE / f"{TEST_INDEX_NAME}.json"
+TEMPLATE_PATH = _HERE / f"{TEST_INDEX_NAME}.template.json"
+
+
+@pytest.fixture(scope="session")
+def test_docs() -> List[Dict[str, Any]]:
+    return loads(DATA_PATH.read_bytes())
+
+
+@pytest.fixture(scope="session")
+def test_index_template() -> Dict[str, Any]:
+    return loads(TEMPLATE_PATH.read_bytes())
+
+
+@pytest.fixture(scope="session")
+def es_client() -> Elasticsearch:
+    return get_elasticsearch_client()
+
+
+@pytest.fixture(scope="session")
+def indexed_test_data(
+    es_client: Elasticsearch,
+    test_docs: List[Dict[str, Any]],
+    test_index_template: Dict[str, Any],
+) -> str:
+    """
+    Make sure the read-only test index holds the full test data set, so read-only tests need no ordering
+    """
+
+    es_client.indices.refresh(index=READ_INDEX_NAME, ignore_unavailable=True)
+    # a missing index returns an error body without a count
+    if es_client.count(index=READ_INDEX_NAME, ignore=[404]).get("count") != len(
+        test_docs
+    ):
+        es_client.indices.delete(index=READ_INDEX_NAME, ignore=[404])
+        index_to_elasticsearch(
+            elasticsearch_client=es_client,
+            index=READ_INDEX_NAME,
+            # the shared template only matches TEST_INDEX_NAME
+            index_template={
+                **test_index_template,
+                "index_patterns": [READ_INDEX_NAME],
+            },
+            docs=test_docs,
+        )
+        es_client.indices.refresh(index=READ_INDEX_NAME)
+
+    # load doc values for the aggregated fields once, so the aggregation tests start warm
+    es_client.search(
+        index=READ_INDEX_NAME,
+        body={
+            "size": 0,
+            "aggs": {
+                "w_article": {"terms": {"field": "article", "size": 1}},
+                "w_date": {"terms": {"field": "date", "size": 1}},
+                "w_views": {"stats": {"field": "views"}},
+            },
+        },
+    )
+
+    return READ_INDEX_NAME
@@ -1,7 +1,6 @@
 from __future__ import annotations
 
-import json
-from pathlib import Path
+import math
 
 import elasticsearch
 import pytest
@@ -10,17 +9,37 @@ from elasticbud import (
     get_async_elasticsearch_client,
     async_check_elasticsearch,
     async_document_exists,
+    async_documents_exist,
     async_index_to_elasticsearch,
     async_get_response_value,
     async_fields_in_hits,
+    async_fields_in_index,
 )
 from elasticbud.errors import ElasticsearchUnreachableError
 
 
 TEST_INDEX_NAME = "elasticbud-test-data"
 
+# shared by the plain and wildcard tests so identical request bodies hit the shard request cache
+AGG_QUERY = {
+    "size": 0,
+    "_source": False,
+    "query": {"match_all": {}},
+    "aggs": {
+        "top_pages": {
+            "terms": {
+                "field": "article",
+                "order": {"views": "desc"},
+                "size": 5,
+            },
+            "aggs": {"views": {"avg": {"field": "views"}}},
+        }
+    },
+}
+
 
 @pytest.mark.asyncio
+@pytest.mark.xdist_group(name="index-writes")
 @pytest.mark.depends(name="test_async_check_elasticsearch")
 async def test_async_check_elasticsearch() -> None:
     client = get_async_elasticsearch_client()
@@ -39,26 +58,38 @@ async def test_async_check_elasticsearch() -> None:
 
 
 @pytest.mark.asyncio
+@pytest.mark.xdist_group(name="index-writes")
 @pytest.mark.depends(on=["test_async_check_elasticsearch"])
-async def test_async_index_to_elasticsearch() -> None:
+# 300 splits the dirty pass into two batches, 1000 sends it as one
+@pytest.mark.parametrize("batch_size", [300, 1000])
+async def test_async_index_to_elasticsearch(
+    test_docs: List[Dict[str, Any]],
+    test_index_template: Dict[str, Any],
+    batch_size: int,
+) -> None:
     client = get_async_elasticsearch_client()
 
-    docs = json.loads(
-        Path(__file__).parent.joinpath(f"{TEST_INDEX_NAME}.json").read_text()
-    )
+    docs = test_docs
 
-    if await client.indices.exists(index=TEST_INDEX_NAME):
-        await client.indices.delete(index=TEST_INDEX_NAME)
+    await client.indices.delete(index=TEST_INDEX_NAME, ignore=[404])
 
-    index_template = json.loads(
-        Path(__file__).parent.joinpath(f"{TEST_INDEX_NAME}.template.json").read_text()
-    )
+    index_template = test_index_template
+
+    # the index is created without refreshes or replicas while it is bulk loaded
+    bulk_load_template = {
+        **index_template,
+        "settings": {
+            **index_template["settings"],
+            "refresh_interval": "-1",
+            "number_of_replicas": 0,
+        },
+    }
 
     # fresh naive indexing operation
     await async_index_to_elasticsearch(
         elasticsearch_client=client,
         index=TEST_INDEX_NAME,
-        index_template=index_template,
+        index_template=bulk_load_template,
         docs=docs[:500],  # first 500 docs in
     )
 
@@ -68,14 +99,22 @@ async def test_async_index_to_elasticsearch() -> None:
         index=TEST_INDEX_NAME,
         docs=docs[300:],  # from the 300th document onward (200 already exist)
         identity_fields=["date", "article"],
-        batch_size=300,  # test batch size customization
+        batch_size=batch_size,  # test batch size customization
+        refresh_before_check=True,  # make the first 500 docs visible to the check
     )
 
+    await client.indices.put_settings(
+        index=TEST_INDEX_NAME,
+        body={
+            "index": {
+                "refresh_interval": "1s",
+                "number_of_replicas": index_template["settings"]["number_of_replicas"],
+            }
+        },
+    )
     await client.indices.refresh(index=TEST_INDEX_NAME)
 
-    assert int(
-        (await client.cat.count(TEST_INDEX_NAME, params={"format": "json"}))[0]["count"]
-    ) == len(docs)
+    assert (await client.count(index=TEST_INDEX_NAME))["count"] == len(docs)
 
     applied_mapping = await client.indices.get_mapping(TEST_INDEX_NAME)
     source_mapping = {TEST_INDEX_NAME: {"mappings": index_template["mappings"]}}
@@ -86,13 +125,12 @@ async def test_async_index_to_elasticsearch() -> None:
 
 
 @pytest.mark.asyncio
+@pytest.mark.xdist_group(name="index-writes")
 @pytest.mark.depends(on=["test_async_index_to_elasticsearch"])
-async def test_async_document_exists() -> None:
+async def test_async_document_exists(test_docs: List[Dict[str, Any]]) -> None:
     client = get_async_elasticsearch_client()
 
-    docs = json.loads(
-        Path(__file__).parent.joinpath(f"{TEST_INDEX_NAME}.json").read_text()
-    )
+    docs = test_docs
 
     assert await async_document_exists(
         elasticsearch_client=client,
@@ -101,43 +139,37 @@ async def test_async_document_exists() -> None:
         identity_fields=["date", "article"],
     )
 
-    assert not await async_document_exists(
+    # existing and new documents are checked together in one msearch request
+    assert await async_documents_exist(
         elasticsearch_client=client,
-        doc={
-            "article": "Elasticbud is the best!",
-            "date": "2025-01-10",
-            "rank": 1,
-            "views": 1000000,
-        },
+        docs=[
+            docs[101],
+            {
+                "article": "Elasticbud is the best!",
+                "date": "2025-01-10",
+                "rank": 1,
+                "views": 1000000,
+            },
+        ],
         index=TEST_INDEX_NAME,
         identity_fields=["date", "article"],
-    )
+    ) == [True, False]
 
     await client.close()
 
 
 @pytest.mark.asyncio
-@pytest.mark.depends(on=["test_async_index_to_elasticsearch"])
-async def test_async_get_response_value_plain_aggregation() -> None:
+@pytest.mark.xdist_group(name="indexed")
+async def test_async_get_response_value_plain_aggregation(
+    indexed_test_data: str,
+) -> None:
     client = get_async_elasticsearch_client()
 
     top_5 = list()
     async for hit in async_get_response_value(
         elasticsearch_client=client,
-        index=TEST_INDEX_NAME,
-        query={
-            "query": {"match_all": {}},
-            "aggs": {
-                "top_pages": {
-                    "terms": {
-                        "field": "article",
-                        "order": {"views": "desc"},
-                        "size": 5,
-                    },
-                    "aggs": {"views": {"avg": {"field": "views"}}},
-                }
-            },
-        },
+        index=indexed_test_data,
+        query=AGG_QUERY,
         value_keys=["aggregations", "top_pages", "buckets"],
     ):
         top_5.extend(hit)
@@ -158,33 +190,27 @@ async def test_async_get_response_value_plain_aggregation() -> None:
         {"key": "Douglas_Emhoff", "doc_count": 1, "views": {"value": 759613.0}},
     ]
 
-    assert top_5 == expected_top_5
+    assert len(top_5) == len(expected_top_5)
+    for bucket, expected_bucket in zip(top_5, expected_top_5):
+        assert bucket["key"] == expected_bucket["key"]
+        assert bucket["doc_count"] == expected_bucket["doc_count"]
+        assert math.isclose(
+            bucket["views"]["value"], expected_bucket["views"]["value"], rel_tol=1e-9
+        )
 
     await client.close()
 
 
 @pytest.mark.asyncio
-@pytest.mark.depends(on=["test_async_index_to_elasticsearch"])
-async def test_async_get_response_value_wildcard() -> None:
+@pytest.mark.xdist_group(name="indexed")
+async def test_async_get_response_value_wildcard(indexed_test_data: str) -> None:
     client = get_async_elasticsearch_client()
 
     top_5_view_counts = list()
     async for hit in async_get_response_value(
         elasticsearch_client=client,
-        index=TEST_INDEX_NAME,
-        query={
-            "query": {"match_all": {}},
-            "aggs": {
-                "top_pages": {
-                    "terms": {
-                        "field": "article",
-                        "order": {"views": "desc"},
-                        "size": 5,
-                    },
-                    "aggs": {"views": {"avg": {"field": "views"}}},
-                }
-            },
-        },
+        index=indexed_test_data,
+        query=AGG_QUERY,
         value_keys=["aggregations", "top_pages", "buckets", "*", "views", "value"],
     ):
         top_5_view_counts.append(hit)
@@ -197,17 +223,25 @@ async def test_async_get_response_value_wildcard() -> None:
         759613.0,
     ]
 
-    assert top_5_view_counts == expected_top_5_view_counts
+    assert len(top_5_view_counts) == len(expected_top_5_view_counts)
+    for view_count, expected_view_count in zip(
+        top_5_view_counts, expected_top_5_view_counts
+    ):
+        assert math.isclose(view_count, expected_view_count, rel_tol=1e-9)
 
     await client.close()
 
 
 @pytest.mark.asyncio
-@pytest.mark.depends(on=["test_async_index_to_elasticsearch"])
-async def test_async_get_response_value_composite_aggregation() -> None:
+@pytest.mark.xdist_group(name="indexed")
+async def test_async_get_response_value_composite_aggregation(
+    indexed_test_data: str,
+) -> None:
     client = get_async_elasticsearch_client()
 
     query = {
+        "size": 0,
+        "_source": False,
         "query": {"match_all": {}},
         "aggs": {
             "all_articles_avg_views": {
@@ -227,7 +261,7 @@ async def test_async_get_response_value_composite_aggregation() -> None:
         key
         async for key in async_get_response_value(
             elasticsearch_client=client,
-            index=TEST_INDEX_NAME,
+            index=indexed_test_data,
             query=query,
             composite_aggregation_name="all_articles_avg_views",
             value_keys=["aggregations", "all_articles_avg_views", "buckets"],
@@ -240,7 +274,7 @@ async def test_async_get_response_value_composite_aggregation() -> None:
         key
         async for key in async_get_response_value(
             elasticsearch_client=client,
-            index=TEST_INDEX_NAME,
+            index=indexed_test_data,
             query=query,
             composite_aggregation_name="all_articles_avg_views",
             value_keys=["aggregations", "all_articles_avg_views", "buckets", "*"],
@@ -253,21 +287,33 @@ async def test_async_get_response_value_composite_aggregation() -> None:
 
 
 @pytest.mark.asyncio
-@pytest.mark.depends(on=["test_async_index_to_elasticsearch"])
-async def test_async_fields_in_hits_from_cluster() -> None:
+@pytest.mark.xdist_group(name="indexed")
+async def test_async_fields_in_hits_from_cluster(indexed_test_data: str) -> None:
     client = get_async_elasticsearch_client()
 
     unique_fields = await async_fields_in_hits(
         async_get_response_value(
             elasticsearch_client=client,
-            index=TEST_INDEX_NAME,
+            index=indexed_test_data,
             query={"query": {"match_all": {}}},
             value_keys=["hits", "hits", "*"],
             debug=True,
-            size=100,
+            size=20,
         )
     )
 
     assert sorted(unique_fields) == ["article", "date", "rank", "views"]
 
     await client.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.xdist_group(name="indexed")
+async def test_async_fields_in_index(indexed_test_data: str) -> None:
+    client = get_async_elasticsearch_client()
+
+    unique_fields = await async_fields_in_index(client, indexed_test_data)
+
+    assert sorted(unique_fields) == ["article", "date", "rank", "views"]
+
+    await client.close()
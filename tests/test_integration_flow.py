@@ -1,7 +1,6 @@
 from __future__ import annotations
 
-import json
-from pathlib import Path
+import math
 
 import elasticsearch
 import pytest
@@ -10,21 +9,39 @@ from elasticbud import (
     get_elasticsearch_client,
     check_elasticsearch,
     document_exists,
+    documents_exist,
     index_to_elasticsearch,
     get_response_value,
     fields_in_hits,
+    fields_in_index,
 )
 from elasticbud.errors import ElasticsearchUnreachableError
 
 
 TEST_INDEX_NAME = "elasticbud-test-data"
 
+# shared by the plain and wildcard tests so identical request bodies hit the shard request cache
+AGG_QUERY = {
+    "size": 0,
+    "_source": False,
+    "query": {"match_all": {}},
+    "aggs": {
+        "top_pages": {
+            "terms": {
+                "field": "article",
+                "order": {"views": "desc"},
+                "size": 5,
+            },
+            "aggs": {"views": {"avg": {"field": "views"}}},
+        }
+    },
+}
 
-@pytest.mark.depends(name="test_check_elasticsearch")
-def test_check_elasticsearch() -> None:
-    client = get_elasticsearch_client()
 
-    check_elasticsearch(client)
+@pytest.mark.xdist_group(name="index-writes")
+@pytest.mark.depends(name="test_check_elasticsearch")
+def test_check_elasticsearch(es_client: Elasticsearch) -> None:
+    check_elasticsearch(es_client)
 
     bad_client = get_elasticsearch_client(
         elasticsearch_client_fqdn="not.an.elasticsearch.cluster.fosure"
@@ -34,99 +51,109 @@ def test_check_elasticsearch() -> None:
         check_elasticsearch(bad_client)
 
 
+@pytest.mark.xdist_group(name="index-writes")
 @pytest.mark.depends(on=["test_check_elasticsearch"])
-def test_index_to_elasticsearch() -> None:
-    client = get_elasticsearch_client()
-
-    docs = json.loads(
-        Path(__file__).parent.joinpath(f"{TEST_INDEX_NAME}.json").read_text()
-    )
-
-    if client.indices.exists(index=TEST_INDEX_NAME):
-        client.indices.delete(index=TEST_INDEX_NAME)
-
-    index_template = json.loads(
-        Path(__file__).parent.joinpath(f"{TEST_INDEX_NAME}.template.json").read_text()
-    )
+# 300 splits the dirty pass into two batches, 1000 sends it as one
+@pytest.mark.parametrize("batch_size", [300, 1000])
+def test_index_to_elasticsearch(
+    es_client: Elasticsearch,
+    test_docs: List[Dict[str, Any]],
+    test_index_template: Dict[str, Any],
+    batch_size: int,
+) -> None:
+    docs = test_docs
+
+    es_client.indices.delete(index=TEST_INDEX_NAME, ignore=[404])
+
+    index_template = test_index_template
+
+    # the index is created without refreshes or replicas while it is bulk loaded
+    bulk_load_template = {
+        **index_template,
+        "settings": {
+            **index_template["settings"],
+            "refresh_interval": "-1",
+            "number_of_replicas": 0,
+        },
+    }
 
     # fresh naive indexing operation
     index_to_elasticsearch(
-        elasticsearch_client=client,
+        elasticsearch_client=es_client,
         index=TEST_INDEX_NAME,
-        index_template=index_template,
+        index_template=bulk_load_template,
         docs=docs[:500],  # first 500 docs in
     )
 
     # dirty indexing operation with idempotency
     index_to_elasticsearch(
-        elasticsearch_client=client,
+        elasticsearch_client=es_client,
         index=TEST_INDEX_NAME,
         docs=docs[300:],  # from the 300th document onward (200 already exist)
         identity_fields=["date", "article"],
-        batch_size=300,  # test batch size customization
+        batch_size=batch_size,  # test batch size customization
+        refresh_before_check=True,  # make the first 500 docs visible to the check
     )
 
-    client.indices.refresh(index=TEST_INDEX_NAME)
+    es_client.indices.put_settings(
+        index=TEST_INDEX_NAME,
+        body={
+            "index": {
+                "refresh_interval": "1s",
+                "number_of_replicas": index_template["settings"]["number_of_replicas"],
+            }
+        },
+    )
+    es_client.indices.refresh(index=TEST_INDEX_NAME)
 
-    assert int(
-        client.cat.count(TEST_INDEX_NAME, params={"format": "json"})[0]["count"]
-    ) == len(docs)
+    assert es_client.count(index=TEST_INDEX_NAME)["count"] == len(docs)
 
-    applied_mapping = client.indices.get_mapping(TEST_INDEX_NAME)
+    applied_mapping = es_client.indices.get_mapping(TEST_INDEX_NAME)
     source_mapping = {TEST_INDEX_NAME: {"mappings": index_template["mappings"]}}
 
     assert applied_mapping == source_mapping
 
 
+@pytest.mark.xdist_group(name="index-writes")
 @pytest.mark.depends(on=["test_index_to_elasticsearch"])
-def test_document_exists() -> None:
-    client = get_elasticsearch_client()
-
-    docs = json.loads(
-        Path(__file__).parent.joinpath(f"{TEST_INDEX_NAME}.json").read_text()
-    )
+def test_document_exists(
+    es_client: Elasticsearch, test_docs: List[Dict[str, Any]]
+) -> None:
+    docs = test_docs
 
     assert document_exists(
-        elasticsearch_client=client,
+        elasticsearch_client=es_client,
         doc=docs[101],
         index=TEST_INDEX_NAME,
         identity_fields=["date", "article"],
     )
 
-    assert not document_exists(
-        elasticsearch_client=client,
-        doc={
-            "article": "Elasticbud is the best!",
-            "date": "2025-01-10",
-            "rank": 1,
-            "views": 1000000,
-        },
+    # existing and new documents are checked together in one msearch request
+    assert documents_exist(
+        elasticsearch_client=es_client,
+        docs=[
+            docs[101],
+            {
+                "article": "Elasticbud is the best!",
+                "date": "2025-01-10",
+                "rank": 1,
+                "views": 1000000,
+            },
+        ],
         index=TEST_INDEX_NAME,
         identity_fields=["date", "article"],
-    )
+    ) == [True, False]
 
 
-@pytest.mark.depends(on=["test_index_to_elasticsearch"])
-def test_get_response_value_plain_aggregation() -> None:
-    client = get_elasticsearch_client()
-
+@pytest.mark.xdist_group(name="indexed")
+def test_get_response_value_plain_aggregation(
+    es_client: Elasticsearch, indexed_test_data: str
+) -> None:
     top_5 = next(
         get_response_value(
-            elasticsearch_client=client,
-            index=TEST_INDEX_NAME,
-            query={
-                "query": {"match_all": {}},
-                "aggs": {
-                    "top_pages": {
-                        "terms": {
-                            "field": "article",
-                            "order": {"views": "desc"},
-                            "size": 5,
-                        },
-                        "aggs": {"views": {"avg": {"field": "views"}}},
-                    }
-                },
-            },
+            elasticsearch_client=es_client,
+            index=indexed_test_data,
+            query=AGG_QUERY,
             value_keys=["aggregations", "top_pages", "buckets"],
         )
     )
@@ -146,34 +173,27 @@ def test_get_response_value_plain_aggregation() -> None:
         {"key": "Douglas_Emhoff", "doc_count": 1, "views": {"value": 759613.0}},
     ]
 
-    assert top_5 == expected_top_5
+    assert len(top_5) == len(expected_top_5)
+    for bucket, expected_bucket in zip(top_5, expected_top_5):
+        assert bucket["key"] == expected_bucket["key"]
+        assert bucket["doc_count"] == expected_bucket["doc_count"]
+        assert math.isclose(
+            bucket["views"]["value"], expected_bucket["views"]["value"], rel_tol=1e-9
+        )
 
 
-@pytest.mark.depends(on=["test_index_to_elasticsearch"])
-def test_get_response_value_wildcard() -> None:
-    client = get_elasticsearch_client()
-
-    top_5_view_counts = [
-        views
-        for views in get_response_value(
-            elasticsearch_client=client,
-            index=TEST_INDEX_NAME,
-            query={
-                "query": {"match_all": {}},
-                "aggs": {
-                    "top_pages": {
-                        "terms": {
-                            "field": "article",
-                            "order": {"views": "desc"},
-                            "size": 5,
-                        },
-                        "aggs": {"views": {"avg": {"field": "views"}}},
-                    }
-                },
-            },
+@pytest.mark.xdist_group(name="indexed")
+def test_get_response_value_wildcard(
+    es_client: Elasticsearch, indexed_test_data: str
+) -> None:
+    top_5_view_counts = list(
+        get_response_value(
+            elasticsearch_client=es_client,
+            index=indexed_test_data,
+            query=AGG_QUERY,
             value_keys=["aggregations", "top_pages", "buckets", "*", "views", "value"],
         )
-    ]
+    )
     expected_top_5_view_counts = [
         5854604.666666667,
         1704162.3333333333,
@@ -182,14 +202,20 @@ def test_get_response_value_wildcard() -> None:
         759613.0,
     ]
 
-    assert top_5_view_counts == expected_top_5_view_counts
+    assert len(top_5_view_counts) == len(expected_top_5_view_counts)
+    for view_count, expected_view_count in zip(
+        top_5_view_counts, expected_top_5_view_counts
+    ):
+        assert math.isclose(view_count, expected_view_count, rel_tol=1e-9)
 
 
-@pytest.mark.depends(on=["test_index_to_elasticsearch"])
-def test_get_response_value_composite_aggregation() -> None:
-    client = get_elasticsearch_client()
-
+@pytest.mark.xdist_group(name="indexed")
+def test_get_response_value_composite_aggregation(
+    es_client: Elasticsearch, indexed_test_data: str
+) -> None:
     query = {
+        "size": 0,
+        "_source": False,
         "query": {"match_all": {}},
         "aggs": {
             "all_articles_avg_views": {
@@ -205,46 +231,48 @@ def test_get_response_value_composite_aggregation() -> None:
         },
     }
 
-    all_articles_avg_views_bucket_sets = [
-        key
-        for key in get_response_value(
-            elasticsearch_client=client,
-            index=TEST_INDEX_NAME,
+    all_articles_avg_views_bucket_sets = list(
+        get_response_value(
+            elasticsearch_client=es_client,
+            index=indexed_test_data,
             query=query,
             composite_aggregation_name="all_articles_avg_views",
             value_keys=["aggregations", "all_articles_avg_views", "buckets"],
         )
-    ]
+    )
 
     assert len(all_articles_avg_views_bucket_sets) == 90
 
+    # each page of buckets was already fetched above, flatten them instead of paginating again
     all_articles_avg_views_buckets = [
-        key
-        for key in get_response_value(
-            elasticsearch_client=client,
-            index=TEST_INDEX_NAME,
-            query=query,
-            composite_aggregation_name="all_articles_avg_views",
-            value_keys=["aggregations", "all_articles_avg_views", "buckets", "*"],
-        )
+        bucket
+        for bucket_set in all_articles_avg_views_bucket_sets
+        for bucket in bucket_set
     ]
 
     assert len(all_articles_avg_views_buckets) == 900
 
 
-@pytest.mark.depends(on=["test_index_to_elasticsearch"])
-def test_fields_in_hits_from_cluster() -> None:
-    client = get_elasticsearch_client()
-
+@pytest.mark.xdist_group(name="indexed")
+def test_fields_in_hits_from_cluster(
+    es_client: Elasticsearch, indexed_test_data: str
+) -> None:
     unique_fields = fields_in_hits(
         get_response_value(
-            elasticsearch_client=client,
-            index=TEST_INDEX_NAME,
+            elasticsearch_client=es_client,
+            index=indexed_test_data,
             query={"query": {"match_all": {}}},
             value_keys=["hits", "hits", "*"],
             debug=True,
-            size=100,
+            size=20,
         )
     )
 
     assert sorted(unique_fields) == ["article", "date", "rank", "views"]
+
+
+@pytest.mark.xdist_group(name="indexed")
+def test_fields_in_index(es_client: Elasticsearch, indexed_test_data: str) -> None:
+    unique_fields = fields_in_index(es_client, indexed_test_data)
+
+    assert sorted(unique_fields) == ["article", "date", "rank", "views"]